@@ -1,7 +1,9 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from markupsafe import escape
 import traceback
-from chat import get_chat_response, save_lead, is_business_email
+from chat import get_chat_response, save_lead, is_business_email, get_policy_stats
+from http_cache import cached_page, compress_response
 import os
 from werkzeug.utils import secure_filename
 import pdfplumber
@@ -15,12 +17,15 @@ UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Negotiate gzip/brotli for every response, including /chat JSON
+app.after_request(compress_response)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route("/")
 def home():
-    return render_template("index.html")
+    return cached_page(app, "index.html")
 
 @app.route("/chat", methods=["POST"])
 def chat():
@@ -100,22 +105,12 @@ def health():
     """Simple health check endpoint"""
     return jsonify({"status": "healthy"})
 
-@app.route("/leads", methods=["GET"])
-def view_leads():
-    """View all captured leads"""
-    import csv
-    import os
-    
-    leads_file = os.path.join(os.path.dirname(__file__), "leads.csv")
-    leads = []
-    
-    if os.path.exists(leads_file):
-        with open(leads_file, 'r', newline='') as file:
-            reader = csv.DictReader(file)
-            leads = list(reader)
-    
-    # Return as HTML table for easy viewing
-    html = """
+@app.route("/chat/stats", methods=["GET"])
+def chat_stats():
+    """Latency and token accounting per generation policy"""
+    return jsonify(get_policy_stats())
+
+LEADS_PAGE_HEAD = """
     <html>
     <head>
         <title>PALMS™ Chatbot Leads</title>
@@ -133,24 +128,70 @@ def view_leads():
     <body>
         <h1>PALMS™ Chatbot Demo Leads</h1>
         <a href="/leads/download" class="download">📥 Download CSV</a>
-        <p><strong>Total Leads:</strong> """ + str(len(leads)) + """</p>
         <table>
             <tr><th>Name</th><th>Email</th></tr>
     """
-    
-    for lead in leads:
-        html += f"<tr><td>{lead.get('Name', '')}</td><td>{lead.get('Email', '')}</td></tr>"
-    
-    html += """
+
+LEADS_PAGE_FOOT = """
         </table>
+        <p><strong>Total Leads:</strong> {total}</p>
         <p style="margin-top: 40px; color: #666;">
             <small>Leads are captured when visitors fill out the demo form in your chatbot widget.</small>
         </p>
     </body>
     </html>
     """
+
+# Number of table rows yielded per chunk when streaming /leads
+LEADS_ROWS_PER_CHUNK = 500
+
+@app.route("/leads", methods=["GET"])
+def view_leads():
+    """View all captured leads"""
+    import csv
+    import os
+    
+    leads_file = os.path.join(os.path.dirname(__file__), "leads.csv")
+    stat = os.stat(leads_file) if os.path.exists(leads_file) else None
+    
+    def snapshot_lines(file):
+        # save_lead only appends, so stopping at the stat'ed size keeps the
+        # body in step with the ETag/Last-Modified taken from that stat
+        remaining = stat.st_size
+        for line in file:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line.decode('utf-8')
     
-    return html
+    def generate():
+        # Render the table incrementally instead of concatenating one big string
+        yield LEADS_PAGE_HEAD
+        total = 0
+        if stat is not None:
+            with open(leads_file, 'rb') as file:
+                rows = []
+                for lead in csv.DictReader(snapshot_lines(file)):
+                    total += 1
+                    rows.append(f"<tr><td>{escape(lead.get('Name', ''))}</td><td>{escape(lead.get('Email', ''))}</td></tr>")
+                    if len(rows) >= LEADS_ROWS_PER_CHUNK:
+                        yield "".join(rows)
+                        rows = []
+                if rows:
+                    yield "".join(rows)
+        yield LEADS_PAGE_FOOT.replace("{total}", str(total))
+    
+    # Return as HTML table for easy viewing
+    response = Response(stream_with_context(generate()), mimetype="text/html")
+    if stat is not None:
+        # The CSV is append-only, so size and mtime identify its contents
+        response.set_etag(f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+        response.last_modified = stat.st_mtime
+    else:
+        response.set_etag("empty")
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route("/leads/download", methods=["GET"])
 def download_leads():
@@ -168,23 +209,23 @@ def download_leads():
 
 @app.route("/clients")
 def clients():
-    return render_template("clients.html")
+    return cached_page(app, "clients.html")
 
 @app.route("/features")
 def features():
-    return render_template("features.html")
+    return cached_page(app, "features.html")
 
 @app.route("/products")
 def products():
-    return render_template("products.html")
+    return cached_page(app, "products.html")
 
 @app.route("/pricing")
 def pricing():
-    return render_template("pricing.html")
+    return cached_page(app, "pricing.html")
 
 @app.route("/locations")
 def locations():
-    return render_template("locations.html")
+    return cached_page(app, "locations.html")
 
 if __name__ == "__main__":
     print("Starting Flask app...")
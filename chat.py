@@ -8,6 +8,8 @@ from retriever import retrieve
 import traceback
 import csv
 import re
+import threading
+from collections import deque
 
 load_dotenv()
 
@@ -49,6 +51,146 @@ Would you like to know more?
 """
 
 
+# Retrieval-confidence thresholds (cosine similarity from all-MiniLM-L6-v2)
+HIGH_SIMILARITY = 0.60
+LOW_SIMILARITY = 0.25
+AMBIGUOUS_SIMILARITY = 0.40
+CONFIDENT_RELEVANCE_MARGIN = 0.15
+AMBIGUOUS_RELEVANCE_SPREAD = 0.05
+
+# Retrieve once at the widest budget, then narrow per policy
+WIDE_TOP_K = 8
+DEFAULT_TOP_K = 5
+
+GENERATION_POLICIES = {
+    "confident": {"top_k": 1, "max_tokens": 100, "elaborate_max_tokens": 250},
+    "standard": {"top_k": DEFAULT_TOP_K, "max_tokens": 150, "elaborate_max_tokens": 350},
+    "ambiguous": {"top_k": WIDE_TOP_K, "max_tokens": 150, "elaborate_max_tokens": 350},
+    "redirect": {"top_k": 0, "max_tokens": 0, "elaborate_max_tokens": 0},
+}
+
+REDIRECT_RESPONSE = (
+    "I'm not sure I have the right information to answer that. "
+    'Our team would be glad to help you directly - you can reach them '
+    '<a href="https://www.onpalms.com/contact/" target="_blank" style="color:#60a5fa; text-decoration:underline;">here</a>. '
+    "Is there anything else about PALMS™ I can help you with?"
+)
+
+LATENCY_WINDOW = 500
+
+_policy_stats = {}
+_policy_stats_lock = threading.Lock()
+
+
+def select_generation_policy(retrieved, allow_redirect=True):
+    """
+    Pick a generation policy from the retrieval confidence.
+    `retrieved` is ordered by relevance_score, as smart_search returns it.
+    Returns (policy_name, chunks to use as context)
+    """
+    if not retrieved:
+        # No knowledge base loaded - keep the previous behaviour
+        return "standard", retrieved
+
+    by_similarity = sorted(retrieved, key=lambda x: x.get('similarity', 0), reverse=True)
+    top_similarity = by_similarity[0].get('similarity', 0)
+    relevances = [r.get('relevance_score', 0) for r in retrieved]
+
+    if top_similarity < LOW_SIMILARITY and allow_redirect:
+        return "redirect", []
+
+    if len(retrieved) < 3:
+        # Too few chunks to judge margin or spread - use them all
+        policy = "standard"
+    elif (retrieved[0].get('similarity', 0) >= HIGH_SIMILARITY
+            and relevances[0] - relevances[1] >= CONFIDENT_RELEVANCE_MARGIN):
+        # Answer from the same chunk whose lead was measured
+        return "confident", retrieved[:1]
+    elif top_similarity < AMBIGUOUS_SIMILARITY or relevances[0] - relevances[2] < AMBIGUOUS_RELEVANCE_SPREAD:
+        policy = "ambiguous"
+    else:
+        policy = "standard"
+
+    # Same selection smart_search makes: top-k by similarity, ordered by relevance
+    top_k = GENERATION_POLICIES[policy]["top_k"]
+    chunks = by_similarity[:top_k]
+    chunks.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
+    return policy, chunks
+
+
+def record_policy_usage(policy, started, llm_call=False, usage=None, failed=False):
+    """Track latency and token usage per generation policy"""
+    latency_ms = (time.perf_counter() - started) * 1000
+    with _policy_stats_lock:
+        stats = _policy_stats.setdefault(policy, {
+            "requests": 0,
+            "llm_calls": 0,
+            "llm_errors": 0,
+            "calls_with_usage": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "latencies_ms": deque(maxlen=LATENCY_WINDOW),
+        })
+        stats["requests"] += 1
+        stats["latencies_ms"].append(latency_ms)
+        if llm_call:
+            stats["llm_calls"] += 1
+        if failed:
+            stats["llm_errors"] += 1
+        if usage is not None:
+            stats["calls_with_usage"] += 1
+            stats["prompt_tokens"] += usage.prompt_tokens
+            stats["completion_tokens"] += usage.completion_tokens
+
+
+def redirect_response(started):
+    """Templated contact-page reply used when retrieval finds nothing relevant"""
+    record_policy_usage("redirect", started)
+    return {
+        'response': REDIRECT_RESPONSE,
+        'show_demo_popup': False,
+        'show_options': False
+    }
+
+
+def generate_answer(policy, started, full_prompt, max_tokens):
+    """Call the LLM under a policy's budget, recording latency and tokens even on failure"""
+    usage = None
+    failed = True
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "system", "content": SYSTEM_PERSONA},
+                      {"role": "user", "content": full_prompt}],
+            max_tokens=max_tokens,
+            temperature=0.7
+        )
+        usage = response.usage
+        failed = False
+    finally:
+        record_policy_usage(policy, started, llm_call=True, usage=usage, failed=failed)
+    return response.choices[0].message.content.strip()
+
+
+def get_policy_stats():
+    """Per-policy request counts, token totals and p50 latency (this process only)"""
+    summary = {}
+    with _policy_stats_lock:
+        for policy, stats in _policy_stats.items():
+            latencies = sorted(stats["latencies_ms"])
+            calls_with_usage = stats["calls_with_usage"]
+            summary[policy] = {
+                "requests": stats["requests"],
+                "llm_calls": stats["llm_calls"],
+                "llm_errors": stats["llm_errors"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "avg_tokens_per_call": round((stats["prompt_tokens"] + stats["completion_tokens"]) / calls_with_usage, 1) if calls_with_usage else 0,
+                "p50_latency_ms": round(latencies[len(latencies) // 2], 1) if latencies else None,
+            }
+    return summary
+
+
 def detect_demo_request(message):
     """
     Detect if user is asking for a demo based on keywords and context
@@ -265,19 +407,15 @@ def get_chat_response(user_input, extra_context=''):
         else:
             original_question = None
         if original_question is not None and original_question:
-            retrieved = retrieve(original_question)
+            started = time.perf_counter()
+            # The user is following up on an answer already given, so never
+            # send them to the contact page - low confidence just widens top_k
+            policy, retrieved = select_generation_policy(retrieve(original_question, top_k=WIDE_TOP_K), allow_redirect=False)
             context = build_intelligent_context(retrieved)
             convo_type = analyze_conversation_context(original_question, retrieved)
             prompt = get_dynamic_prompt(convo_type, original_question)
             full_prompt = f"{SYSTEM_PERSONA}\nPlease elaborate in simple language, at least 70 words, about: {original_question}. Do not repeat the previous answer.\n{prompt}\nContext:\n{context}\nUser: {original_question}\nAnswer:"
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "system", "content": SYSTEM_PERSONA},
-                          {"role": "user", "content": full_prompt}],
-                max_tokens=350,
-                temperature=0.7
-            )
-            answer = response.choices[0].message.content.strip()
+            answer = generate_answer(policy, started, full_prompt, GENERATION_POLICIES[policy]["elaborate_max_tokens"])
             return {
                 'response': answer,
                 'show_demo_popup': False,
@@ -285,19 +423,16 @@ def get_chat_response(user_input, extra_context=''):
             }
         # Otherwise, use AI to answer
         # Retrieve context
-        retrieved = retrieve(user_input)
+        started = time.perf_counter()
+        policy, retrieved = select_generation_policy(retrieve(user_input, top_k=WIDE_TOP_K))
+        # Very low similarity: skip the LLM and point to the contact page
+        if policy == "redirect":
+            return redirect_response(started)
         context = build_intelligent_context(retrieved)
         convo_type = analyze_conversation_context(user_input, retrieved)
         prompt = get_dynamic_prompt(convo_type, user_input)
         full_prompt = f"{SYSTEM_PERSONA}\n{prompt}\nContext:\n{context}\nUser: {user_input}\nAnswer:"
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "system", "content": SYSTEM_PERSONA},
-                      {"role": "user", "content": full_prompt}],
-            max_tokens=150,
-            temperature=0.7
-        )
-        answer = response.choices[0].message.content.strip()
+        answer = generate_answer(policy, started, full_prompt, GENERATION_POLICIES[policy]["max_tokens"])
         # Format as list if needed
         answer = format_list_response(answer)
         # Add context-specific links for products and clients
@@ -0,0 +1,166 @@
+# http_cache.py - PRE-RENDERED PAGES, CONDITIONAL GETS AND COMPRESSION
+import gzip
+import zlib
+import hashlib
+import threading
+from datetime import datetime, timezone
+from flask import Response, render_template, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Responses smaller than this are not worth the compression overhead
+MIN_COMPRESS_SIZE = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Static pages are compressed once, so they can afford the best ratio
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+
+PAGE_MAX_AGE = 300
+
+_page_cache = {}
+_page_cache_lock = threading.Lock()
+
+
+class CachedPage:
+    """A rendered template with its content hash and pre-encoded bodies"""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.encoded = {"gzip": gzip.compress(body, compresslevel=STATIC_GZIP_LEVEL)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(body, quality=STATIC_BROTLI_QUALITY)
+
+
+def _get_cached_page(app, template_name):
+    """
+    Pages are rendered once per process, so template changes show up on
+    deploy/restart. With template auto-reload enabled (debug or
+    TEMPLATES_AUTO_RELOAD) every hit re-renders through Jinja, which also
+    picks up edited parents and includes, and the cached page is only
+    replaced when the rendered content hash changes.
+    """
+    page = _page_cache.get(template_name)
+    if page is not None and not app.jinja_env.auto_reload:
+        return page
+
+    with _page_cache_lock:
+        page = _page_cache.get(template_name)
+        if page is not None and not app.jinja_env.auto_reload:
+            return page
+        body = render_template(template_name).encode("utf-8")
+        if page is None or hashlib.sha256(body).hexdigest()[:32] != page.etag:
+            page = CachedPage(body)
+            _page_cache[template_name] = page
+    return page
+
+
+def cached_page(app, template_name):
+    """Serve a static template from the pre-rendered cache with validators"""
+    page = _get_cached_page(app, template_name)
+    coding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+
+    if coding in page.encoded:
+        response = Response(page.encoded[coding], mimetype="text/html")
+        response.headers["Content-Encoding"] = coding
+        # The encoded body differs byte-wise from the identity one
+        response.set_etag(page.etag, weak=True)
+    else:
+        response = Response(page.body, mimetype="text/html")
+        response.set_etag(page.etag)
+
+    response.last_modified = page.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = PAGE_MAX_AGE
+    response.vary.add("Accept-Encoding")
+    return response.make_conditional(request)
+
+
+def clear_page_cache():
+    with _page_cache_lock:
+        _page_cache.clear()
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick the best supported content coding from an Accept-Encoding header"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        pieces = part.strip().split(";")
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+
+    def q(coding):
+        return accepted.get(coding, accepted.get("*", 0.0))
+
+    if brotli is not None and q("br") > 0 and q("br") >= q("gzip"):
+        return "br"
+    if q("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def _stream_encoder(coding):
+    if coding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip container
+    return compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, coding):
+    compress, finish = _stream_encoder(coding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response):
+    """after_request hook: gzip/brotli encode responses the client accepts"""
+    response.vary.add("Accept-Encoding")
+
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+
+    coding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if coding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, coding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_COMPRESS_SIZE:
+            return response
+        if coding == "br":
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        response.set_data(body)
+
+    response.headers["Content-Encoding"] = coding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response